@@ -1,7 +1,10 @@
 import os
-import requests
+import re
+import time
 import asyncio
 import logging
+import aiohttp
+import orjson
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
 
@@ -18,7 +21,46 @@ OZON_API_KEY = os.environ.get('OZON_API_KEY')
 OZON_CLIENT_ID = os.environ.get('OZON_CLIENT_ID')
 
 # Кэш товаров
-products_cache = {}
+products_cache = []
+
+# Сколько товаров запрашивать из Ozon
+PRODUCTS_LIMIT = 20
+
+# Регулярные выражения для очистки описаний от HTML
+_RE_BR = re.compile(r'<br\s*/?>')
+_RE_TAG = re.compile(r'<[^>]+>')
+_RE_BLANK = re.compile(r'\n\s*\n')
+
+# HTTP сессия для запросов к Ozon (создается при первом запросе)
+_http_session = None
+
+# Таймауты запросов к Ozon: быстрый отказ при зависшем соединении,
+# но достаточно времени на чтение больших ответов
+_TIMEOUT = aiohttp.ClientTimeout(total=15, connect=3, sock_connect=3, sock_read=8)
+
+# Ограничение числа одновременных запросов к Ozon
+OZON_MAX_CONCURRENCY = 10
+_OZON_SEM = asyncio.Semaphore(OZON_MAX_CONCURRENCY)
+
+async def get_http_session():
+    """Возвращает общую aiohttp сессию, создавая ее при первом обращении"""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=OZON_MAX_CONCURRENCY,
+                limit_per_host=OZON_MAX_CONCURRENCY,
+                keepalive_timeout=60
+            ),
+            timeout=_TIMEOUT,
+            json_serialize=lambda obj: orjson.dumps(obj).decode()
+        )
+    return _http_session
+
+# Повторы запросов к Ozon при временных ошибках
+RETRY_TOTAL = 2
+RETRY_BACKOFF_FACTOR = 0.2
+RETRY_STATUSES = {429, 502, 503, 504}
 
 class OzonSellerAPI:
     def __init__(self):
@@ -27,9 +69,70 @@ class OzonSellerAPI:
             "Api-Key": OZON_API_KEY,
             "Content-Type": "application/json"
         }
+        # Кэш результатов get_products_with_prices: limit -> (время получения, товары)
+        self._cache = {}
+        self._ttl = 300
+        # Одновременные промахи кэша ждут одного запроса к Ozon
+        self._cache_lock = asyncio.Lock()
+    
+    async def _post(self, url, payload):
+        """Выполняет POST запрос к Ozon через общую сессию с повторами при временных ошибках.
+        Число одновременных запросов ограничено _OZON_SEM.
+        
+        Возвращает кортеж (статус, данные): JSON ответа при статусе 200, иначе текст ответа.
+        """
+        session = await get_http_session()
+        
+        for attempt in range(RETRY_TOTAL + 1):
+            try:
+                async with _OZON_SEM:
+                    async with session.post(url, headers=self.headers, json=payload) as response:
+                        if response.status in RETRY_STATUSES and attempt < RETRY_TOTAL:
+                            logger.warning(f"⚠️ {url}: статус {response.status}, повтор запроса")
+                        elif response.status == 200:
+                            return response.status, orjson.loads(await response.read())
+                        else:
+                            return response.status, await response.text()
+            except (asyncio.TimeoutError, aiohttp.ClientConnectionError):
+                if attempt >= RETRY_TOTAL:
+                    raise
+                logger.warning(f"⚠️ {url}: ошибка подключения, повтор запроса")
+            
+            await asyncio.sleep(RETRY_BACKOFF_FACTOR * (2 ** attempt))
     
-    def get_products_with_prices(self, limit=10):
-        """Получает реальные товары с реальными ценами из Ozon"""
+    async def get_products_with_prices(self, limit=10, force=False):
+        """Получает реальные товары с реальными ценами из Ozon.
+        
+        Результат кэшируется на self._ttl секунд; force=True запрашивает данные заново.
+        Если другой запрос уже получает товары, результат берется из него.
+        """
+        requested_at = time.monotonic()
+        
+        cached = self._cache.get(limit)
+        if not force and cached and requested_at - cached[0] < self._ttl:
+            logger.info("📦 Используем кэшированные товары Ozon")
+            return cached[1]
+        
+        async with self._cache_lock:
+            # Пока ждали блокировку, товары могли быть получены другим запросом
+            cached = self._cache.get(limit)
+            if cached and (cached[0] >= requested_at or
+                           (not force and time.monotonic() - cached[0] < self._ttl)):
+                logger.info("📦 Используем товары, полученные параллельным запросом")
+                return cached[1]
+            
+            products = await self._fetch_products_with_prices(limit)
+            if products:
+                self._cache[limit] = (time.monotonic(), products)
+            return products
+    
+    def cached_at(self, limit=10):
+        """Возвращает время (time.monotonic()) получения кэшированных товаров или None"""
+        cached = self._cache.get(limit)
+        return cached[0] if cached else None
+    
+    async def _fetch_products_with_prices(self, limit):
+        """Запрашивает товары с ценами и описаниями из Ozon без использования кэша"""
         logger.info("🔄 Получение реальных товаров из Ozon API...")
         
         # Проверяем наличие ключей
@@ -40,24 +143,21 @@ class OzonSellerAPI:
         try:
             # 1. Получаем список товаров через v3/product/list
             logger.info("🔍 Получаем список товаров через v3/product/list...")
-            list_response = requests.post(
+            status, list_data = await self._post(
                 "https://api-seller.ozon.ru/v3/product/list",
-                headers=self.headers,
-                json={
+                {
                     "filter": {"visibility": "ALL"},
                     "limit": limit
-                },
-                timeout=10
+                }
             )
-        
-            logger.info(f"📊 Статус ответа v3/product/list: {list_response.status_code}")
             
-            if list_response.status_code != 200:
-                logger.error(f"❌ Ошибка v3/product/list: {list_response.status_code}")
-                logger.error(f"Текст ошибки: {list_response.text}")
+            logger.info(f"📊 Статус ответа v3/product/list: {status}")
+            
+            if status != 200:
+                logger.error(f"❌ Ошибка v3/product/list: {status}")
+                logger.error(f"Текст ошибки: {list_data}")
                 return None
-        
-            list_data = list_response.json()
+            
             items = list_data.get('result', {}).get('items', [])
             logger.info(f"✅ Получено товаров: {len(items)}")
         
@@ -73,75 +173,81 @@ class OzonSellerAPI:
                 logger.error("❌ Не удалось получить product_id товаров")
                 return None
         
-            # 2. Получаем цены через v5/product/info/prices
-            logger.info("🔍 Получаем цены через v5/product/info/prices...")
-            prices_data = self._get_products_prices_v5(product_ids)
-            
-            # 3. Получаем описания товаров через v1/product/info/description
-            logger.info("🔍 Получаем описания товаров через v1/product/info/description...")
-            descriptions_data = self._get_products_descriptions_v1(product_ids)
+            # 2. Параллельно получаем цены через v5/product/info/prices
+            # и названия/описания товаров
+            logger.info("🔍 Получаем цены и описания товаров...")
+            prices_data, descriptions_data = await asyncio.gather(
+                self._get_products_prices_v5(product_ids),
+                self._get_products_descriptions(product_ids)
+            )
         
             # Формируем итоговый список товаров
-            products = []
-            for item in items:
+            # Локальные ссылки на методы сокращают поиск атрибутов в цикле
+            d_get = descriptions_data.get
+            p_get = prices_data.get
+            extract_price = self._extract_price_from_v5
+            clean_description = self._clean_description
+            empty = {}
+            
+            products = [None] * len(items)
+            for index, item in enumerate(items):
                 try:
                     product_id = item.get('product_id')
-                    offer_id = item.get('offer_id')
-                
                     if not product_id:
                         continue
+                    offer_id = item.get('offer_id')
                 
                     # Получаем название и описание товара
-                    product_info = descriptions_data.get(product_id, {})
+                    product_info = d_get(product_id, empty)
                     name = product_info.get('name', offer_id or f"Товар {product_id}")
-                    description = product_info.get('description', '')
+                    description = product_info.get('description')
                     
                     # Если нет описания, используем название товара
                     if not description:
                         description = name
                     else:
                         # Очищаем описание от HTML тегов и обрезаем если слишком длинное
-                        description = self._clean_description(description)
+                        description = clean_description(description)
                         if len(description) > 200:
                             description = description[:197] + "..."
                 
                     # Получаем реальную цену из v5
-                    price = self._extract_price_from_v5(prices_data.get(product_id, {}))
+                    price = extract_price(p_get(product_id, empty))
                     if price == 0:
                         logger.warning(f"⚠️ Пропускаем товар без цены: {name}")
                         continue
                 
-                    quantity = 10
-                
-                    products.append({
+                    products[index] = {
                         'product_id': product_id,
                         'offer_id': offer_id,
                         'name': name,
                         'price': price,
                         'description': description,
-                        'quantity': quantity
-                    })
+                        'quantity': 10
+                    }
                     
-                    logger.info(f"📦 {name} - {price} ₽")
+                    logger.info("📦 %s - %s ₽", name, price)
                 
                 except Exception as e:
                     logger.error(f"❌ Ошибка обработки товара: {e}")
                     continue
+            
+            products = [product for product in products if product is not None]
         
             logger.info(f"✅ Обработано {len(products)} товаров с реальными ценами")
             return products
             
-        except requests.exceptions.Timeout:
+        except asyncio.TimeoutError:
             logger.error("❌ Таймаут подключения к Ozon API")
             return None
-        except requests.exceptions.ConnectionError:
+        except aiohttp.ClientConnectionError:
             logger.error("❌ Ошибка подключения к Ozon API")
             return None
         except Exception as e:
             logger.error(f"❌ Ошибка запроса к Ozon API: {e}")
             return None
     
-    def _get_products_prices_v5(self, product_ids):
+    async def _get_products_prices_v5(self, product_ids):
         """Получает цены товаров через v5/product/info/prices"""
         prices_data = {}
         
@@ -153,22 +259,19 @@ class OzonSellerAPI:
             for i in range(0, len(product_ids), 50):
                 batch_ids = product_ids[i:i+50]
             
-                prices_response = requests.post(
+                status, prices_result = await self._post(
                     "https://api-seller.ozon.ru/v5/product/info/prices",
-                    headers=self.headers,
-                    json={
+                    {
                         "filter": {
                             "product_id": batch_ids,
                             "visibility": "ALL"
                         },
                         "last_id": "",
                         "limit": 1000
-                    },
-                    timeout=10
+                    }
                 )
             
-                if prices_response.status_code == 200:
-                    prices_result = prices_response.json()
+                if status == 200:
                     price_items = prices_result.get('items', [])
                     logger.info(f"💰 Получены цены для {len(price_items)} товаров")
                 
@@ -177,8 +280,8 @@ class OzonSellerAPI:
                         prices_data[product_id] = price_item
                         
                 else:
-                    logger.error(f"❌ Ошибка получения цен v5: {prices_response.status_code}")
-                    logger.error(f"Текст ошибки: {prices_response.text}")
+                    logger.error(f"❌ Ошибка получения цен v5: {status}")
+                    logger.error(f"Текст ошибки: {prices_result}")
         
             return prices_data
         
@@ -186,7 +289,61 @@ class OzonSellerAPI:
             logger.error(f"❌ Ошибка получения цен v5: {e}")
             return {}
     
-    def _get_products_descriptions_v1(self, product_ids):
+    async def _get_products_descriptions(self, product_ids):
+        """Получает названия и описания товаров.
+        
+        Описания есть только в v1/product/info/description (запрос на каждый товар),
+        поэтому v3/product/info/list используется лишь для названий и выполняется
+        параллельно с запросами описаний.
+        """
+        if not product_ids:
+            return {}
+        
+        names_data, descriptions_data = await asyncio.gather(
+            self._get_products_names_v3(product_ids),
+            self._get_products_descriptions_v1(product_ids)
+        )
+        
+        # Название из v3 используется, если описание из v1 получить не удалось
+        for product_id, name in names_data.items():
+            product_info = descriptions_data.setdefault(product_id, {'name': '', 'description': ''})
+            product_info['name'] = product_info['name'] or name
+        
+        return descriptions_data
+    
+    async def _get_products_names_v3(self, product_ids):
+        """Получает названия товаров пакетно через v3/product/info/list"""
+        names_data = {}
+        
+        try:
+            # Разбиваем на группы по 1000 product_id
+            for i in range(0, len(product_ids), 1000):
+                batch_ids = product_ids[i:i+1000]
+            
+                status, info_result = await self._post(
+                    "https://api-seller.ozon.ru/v3/product/info/list",
+                    {"product_id": batch_ids}
+                )
+            
+                if status == 200:
+                    info_items = info_result.get('items', [])
+                    logger.info(f"📝 Получены названия для {len(info_items)} товаров")
+                
+                    for info_item in info_items:
+                        if info_item.get('name'):
+                            names_data[info_item.get('id')] = info_item['name']
+                        
+                else:
+                    logger.error(f"❌ Ошибка получения информации v3: {status}")
+                    logger.error(f"Текст ошибки: {info_result}")
+            
+            return names_data
+        
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения информации v3: {e}")
+            return {}
+    
+    async def _get_products_descriptions_v1(self, product_ids):
         """Получает описания товаров через v1/product/info/description"""
         descriptions_data = {}
         
@@ -194,27 +351,37 @@ class OzonSellerAPI:
             return descriptions_data
             
         try:
-            for product_id in product_ids:
-                description_response = requests.post(
+            async def fetch_description(product_id):
+                status, description_response = await self._post(
                     "https://api-seller.ozon.ru/v1/product/info/description",
-                    headers=self.headers,
-                    json={"product_id": product_id},
-                    timeout=10
+                    {"product_id": product_id}
                 )
+                if status != 200:
+                    logger.warning(f"⚠️ Ошибка получения описания для {product_id}: {status}")
+                    return product_id, None
+                return product_id, description_response.get('result', {})
+            
+            # Запрашиваем описания параллельно; ошибка одного товара не отменяет остальные
+            results = await asyncio.gather(
+                *[fetch_description(product_id) for product_id in product_ids],
+                return_exceptions=True
+            )
+            
+            for product_id, result in zip(product_ids, results):
+                if isinstance(result, Exception):
+                    logger.warning(f"⚠️ Ошибка получения описания для {product_id}: {result!r}")
+                    continue
                 
-                if description_response.status_code == 200:
-                    description_result = description_response.json().get('result', {})
-                    if description_result:
-                        name = description_result.get('name', '')
-                        description = description_result.get('description', '')
-                        
-                        descriptions_data[product_id] = {
-                            'name': name,
-                            'description': description
-                        }
-                        logger.info(f"📝 Получено описание для товара {product_id}")
-                else:
-                    logger.warning(f"⚠️ Ошибка получения описания для {product_id}: {description_response.status_code}")
+                description_result = result[1]
+                if description_result:
+                    name = description_result.get('name', '')
+                    description = description_result.get('description', '')
+                    
+                    descriptions_data[product_id] = {
+                        'name': name,
+                        'description': description
+                    }
+                    logger.debug("📝 Получено описание для товара %s", product_id)
             
             logger.info(f"📝 Всего получено описаний: {len(descriptions_data)}")
             return descriptions_data
@@ -229,46 +396,29 @@ class OzonSellerAPI:
             return ""
         
         # Удаляем основные HTML теги
-        import re
-        clean_text = re.sub(r'<br\s*/?>', '\n', description)
-        clean_text = re.sub(r'<[^>]+>', '', clean_text)
-        clean_text = re.sub(r'\n\s*\n', '\n', clean_text)
+        clean_text = _RE_BR.sub('\n', description)
+        clean_text = _RE_TAG.sub('', clean_text)
+        clean_text = _RE_BLANK.sub('\n', clean_text)
         clean_text = clean_text.strip()
         
         return clean_text
     
     def _extract_price_from_v5(self, price_item):
-        """Извлекает цену из структуры Ozon v5"""
-        if not price_item or not isinstance(price_item, dict):
-            return 0
-    
+        """Извлекает цену из структуры Ozon v5 (основная цена, запасной вариант - старая цена)"""
         try:
-            price_info = price_item.get('price', {})
-            
-            if not isinstance(price_info, dict):
-                return 0
-        
-            # Основная цена
-            main_price = price_info.get('price')
-            if main_price:
-                price_int = int(float(main_price))
-                if price_int > 0:
-                    logger.info(f"✅ Найдена цена: {price_int} ₽")
-                    return price_int
-        
-            # Старая цена как запасной вариант
-            old_price = price_info.get('old_price')
-            if old_price:
-                price_int = int(float(old_price))
-                if price_int > 0:
-                    logger.info(f"✅ Найдена старая цена: {price_int} ₽")
-                    return price_int
+            price_info = price_item['price']
+            # Ozon передает цены строками, "0.0000" означает отсутствие цены
+            for key in ('price', 'old_price'):
+                value = price_info.get(key)
+                if value:
+                    price_int = int(float(value))
+                    if price_int > 0:
+                        logger.debug("✅ Найдена цена (%s): %s ₽", key, price_int)
+                        return price_int
+        except (KeyError, TypeError, ValueError, AttributeError):
+            pass
         
-            return 0
-        
-        except Exception as e:
-            logger.error(f"❌ Ошибка извлечения цены: {e}")
-            return 0
+        return 0
 
     def create_product_link(self, product):
         """Создает ссылку на страницу товара в Ozon"""
@@ -281,7 +431,24 @@ class OzonSellerAPI:
 # Инициализация API
 ozon_api = OzonSellerAPI()
 
-async def load_real_products():
+# Статические клавиатуры (создаются один раз при загрузке модуля)
+_START_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🛍️ Смотреть товары", callback_data="view_products")],
+    [InlineKeyboardButton("🔄 Обновить товары", callback_data="refresh_products")]
+])
+
+_REFRESH_SUCCESS_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🛍️ Смотреть товары", callback_data="view_products")]
+])
+
+_REFRESH_ERROR_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔄 Попробовать снова", callback_data="refresh_products")],
+    [InlineKeyboardButton("🛍️ Использовать текущий список", callback_data="view_products")]
+])
+
+_PRODUCT_LIST_ROW = (InlineKeyboardButton("📋 К списку товаров", callback_data="view_products"),)
+
+async def load_real_products(force=False):
     """Загружает только реальные товары из Ozon API"""
     global products_cache
     
@@ -289,49 +456,25 @@ async def load_real_products():
     
     if not OZON_CLIENT_ID or not OZON_API_KEY:
         logger.error("❌ API ключи не настроены!")
-        products_cache = {}
-        return {}
+        products_cache = []
+        return products_cache
     
-    products_data = ozon_api.get_products_with_prices(limit=20)
+    products_data = await ozon_api.get_products_with_prices(limit=PRODUCTS_LIMIT, force=force)
     
     if not products_data:
         logger.error("❌ Не удалось получить реальные товары через Ozon API")
-        products_cache = {}
-        return {}
-    
-    products = {}
-    product_counter = 1
+        products_cache = []
+        return products_cache
     
+    # Ссылки на товары зависят только от offer_id, поэтому формируем их один раз
     for item in products_data:
-        try:
-            product_id = item.get('product_id', '')
-            offer_id = item.get('offer_id', '')
-            name = item.get('name', '')
-            price = item.get('price', 0)
-            description = item.get('description', '')
-            quantity = item.get('quantity', 10)
-            
-            product_key = product_counter
-            
-            products[product_key] = {
-                'product_id': product_id,
-                'offer_id': offer_id,
-                'name': name,
-                'price': price,
-                'description': description,
-                'quantity': quantity
-            }
-            
-            logger.info(f"✅ Товар {product_counter}: {name} - {price} ₽")
-            product_counter += 1
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка обработки товара: {e}")
-            continue
+        item['url'] = ozon_api.create_product_link(item)
+    
+    # Используем список, полученный от API, без копирования
+    products_cache = products_data
     
-    logger.info(f"🎯 Загружено {len(products)} реальных товаров с реальными ценами из Ozon")
-    products_cache = products
-    return products
+    logger.info(f"🎯 Загружено {len(products_cache)} реальных товаров с реальными ценами из Ozon")
+    return products_cache
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
@@ -353,19 +496,13 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 Используйте кнопки ниже для навигации:
 """
 
-    keyboard = [
-        [InlineKeyboardButton("🛍️ Смотреть товары", callback_data="view_products")],
-        [InlineKeyboardButton("🔄 Обновить товары", callback_data="refresh_products")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await update.message.reply_text(welcome_text, reply_markup=reply_markup)
+    await update.message.reply_text(welcome_text, reply_markup=_START_MARKUP)
 
 async def refresh_products(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /refresh для обновления товаров"""
     await update.message.reply_text("🔄 Обновляем список реальных товаров...")
     products_count_before = len(products_cache)
-    await load_real_products()
+    await load_real_products(force=True)
     products_count_after = len(products_cache)
     
     if products_count_after > 0:
@@ -384,10 +521,26 @@ async def refresh_products_callback(query, context):
     await query.edit_message_text("🔄 Обновляем список товаров...")
     
     products_count_before = len(products_cache)
+    started_at = time.monotonic()
     await load_real_products()
     products_count_after = len(products_cache)
     
-    if products_count_after > 0:
+    fetched_at = ozon_api.cached_at(PRODUCTS_LIMIT)
+    
+    if products_count_after > 0 and fetched_at is not None and fetched_at < started_at:
+        # Товары взяты из кэша, а не получены из Ozon заново
+        age_minutes = int((started_at - fetched_at) // 60)
+        success_text = f"""
+✅ Список товаров загружен из кэша
+
+📦 Доступно товаров: {products_count_after}
+
+Данные получены из Ozon {age_minutes} мин. назад.
+Для принудительного обновления используйте /refresh.
+"""
+        
+        await query.edit_message_text(success_text, reply_markup=_REFRESH_SUCCESS_MARKUP)
+    elif products_count_after > 0:
         success_text = f"""
 ✅ Товары обновлены!
 
@@ -397,12 +550,7 @@ async def refresh_products_callback(query, context):
 Список товаров актуален на текущий момент.
 """
         
-        keyboard = [
-            [InlineKeyboardButton("🛍️ Смотреть товары", callback_data="view_products")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(success_text, reply_markup=reply_markup)
+        await query.edit_message_text(success_text, reply_markup=_REFRESH_SUCCESS_MARKUP)
     else:
         error_text = """
 ❌ Не удалось обновить товары
@@ -410,13 +558,7 @@ async def refresh_products_callback(query, context):
 Проверьте настройки API ключей Ozon.
 """
         
-        keyboard = [
-            [InlineKeyboardButton("🔄 Попробовать снова", callback_data="refresh_products")],
-            [InlineKeyboardButton("🛍️ Использовать текущий список", callback_data="view_products")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(error_text, reply_markup=reply_markup)
+        await query.edit_message_text(error_text, reply_markup=_REFRESH_ERROR_MARKUP)
 
 async def show_products(query, context):
     """Показывает список реальных товаров"""
@@ -426,17 +568,16 @@ async def show_products(query, context):
         )
         return
     
-    await show_product_detail(query, context, 1)
+    await show_product_detail(query, context, 0)
 
 async def show_product_detail(query, context, product_index):
     """Показывает детали реального товара с ссылкой на Ozon"""
-    product = products_cache.get(product_index)
-    if not product:
+    if not products_cache:
         await query.edit_message_text("❌ Товар не найден")
         return
     
-    # Создаем ссылку на товар в Ozon
-    product_url = ozon_api.create_product_link(product)
+    product_index %= len(products_cache)
+    product = products_cache[product_index]
     
     product_text = f"""
 📦 {product['name']}
@@ -450,10 +591,10 @@ async def show_product_detail(query, context, product_index):
 """
     
     keyboard = [
-        [InlineKeyboardButton("🛍️ Перейти к товару в Ozon", url=product_url)],
+        [InlineKeyboardButton("🛍️ Перейти к товару в Ozon", url=product['url'])],
         [InlineKeyboardButton("⬅️ Предыдущий", callback_data=f"product_prev_{product_index}"),
          InlineKeyboardButton("Следующий ➡️", callback_data=f"product_next_{product_index}")],
-        [InlineKeyboardButton("📋 К списку товаров", callback_data="view_products")]
+        _PRODUCT_LIST_ROW
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -469,16 +610,11 @@ async def handle_product_action(query, context, callback_data):
     action = parts[1]
     product_index = int(parts[2])
     
+    # Индекс переходит через край списка в show_product_detail
     if action == "next":
-        next_index = product_index + 1
-        if next_index > len(products_cache):
-            next_index = 1
-        await show_product_detail(query, context, next_index)
+        await show_product_detail(query, context, product_index + 1)
     elif action == "prev":
-        prev_index = product_index - 1
-        if prev_index < 1:
-            prev_index = len(products_cache)
-        await show_product_detail(query, context, prev_index)
+        await show_product_detail(query, context, product_index - 1)
 
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик callback запросов от кнопок"""
@@ -494,8 +630,8 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif callback_data.startswith("product_"):
         await handle_product_action(query, context, callback_data)
 
-async def preload_products():
-    """Предзагрузка товаров при запуске"""
+async def preload_products(application):
+    """Предзагрузка товаров при запуске (post_init хук Application)"""
     logger.info("🔄 Предзагрузка реальных товаров из Ozon...")
     await load_real_products()
     if products_cache:
@@ -503,24 +639,31 @@ async def preload_products():
     else:
         logger.error("❌ Не удалось загрузить реальные товары")
 
+async def close_http_session(application):
+    """Закрывает HTTP сессию Ozon при остановке бота (post_shutdown хук Application)"""
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+
 def main():
     """Запуск бота"""
     if not BOT_TOKEN:
         logger.error("❌ BOT_TOKEN не найден!")
         return
     
-    application = Application.builder().token(BOT_TOKEN).build()
+    # Предзагрузка товаров выполняется в том же event loop, что и polling
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .post_init(preload_products)
+        .post_shutdown(close_http_session)
+        .build()
+    )
     
     # Обработчики команд
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("refresh", refresh_products))
     application.add_handler(CallbackQueryHandler(handle_callback))
     
-    logger.info("🔄 Загрузка реальных товаров из Ozon...")
-    
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(preload_products())
-    
     logger.info("🛍️ Ozon Client Bot запущен!")
     application.run_polling()
 